@@ -1,7 +1,18 @@
 """CPU functionality."""
 
+import importlib.util
+import os
+import re
 import sys
 
+try:
+    # Optional: compile the run loop to machine code when Numba is installed
+    import numpy as np
+    from numba import njit
+except ImportError:
+    np = None
+    njit = None
+
 LDI = 0b10000010
 PRN = 0b01000111
 HLT = 0b00000001
@@ -23,18 +34,220 @@ SHL = 0b10101100
 SHR = 0b10101101
 MOD = 0b10100100
 
+# Value of every 8 digit binary string, used to load programs
+BIN2BYTE = {f"{value:08b}".encode("ascii"): value for value in range(256)}
+# The text of every line before any comment, which must be blank or an
+# instruction or operand of 8 binary digits
+PROGRAM_LINE = re.compile(rb"^([^#\n]*)", re.MULTILINE)
+
+# Instruction size (opcode + operands) for every opcode, taken from the
+# top two bits of the instruction: ((IR >> 6) & 0b11) + 1
+SIZE_TABLE = bytes(((IR >> 6) & 0b11) + 1 for IR in range(256))
+
+# CPU state printed by CPU.trace(): pc, the next 3 bytes of RAM and
+# the 8 registers
+TRACE_FORMAT = "TRACE: %02X | %02X %02X %02X |" + " %02X" * 8
+
+# Offset of the registers in the state block used by the compiled run loop
+REG = 256
+
+# Reasons the compiled run loop stopped
+HALTED = 0
+UNKNOWN_INSTRUCTION = 1
+DIVIDE_BY_ZERO = 2
+UNTRANSLATED_ADDRESS = 3
+
+# Python source for each instruction, shared by execute() and
+# CPU.compile_program(), listed roughly by how often programs use them
+# (the order execute() tests the opcode in). Each user fills in how to
+# spell the machine state:
+#   {a}, {b}  the registers named by the operands
+#   {value}   the second operand as an immediate value
+#   {sp}      the stack pointer register
+#   {ram}     memory
+#   {pc}      the address of the instruction, {next} the one following it
+#   {jump}    continue at the address in pc
+#   {stop}    stop with pc and status
+# Instructions in BLOCK_ENDS set pc and end with {jump} or {stop}, for the
+# rest execute() moves pc past the instruction itself.
+INSTRUCTIONS = {
+    LDI: "{a} = {value}",
+    CMP: "fl = 0b001 if {a} == {b} else 0b100 if {a} < {b} else 0b010",
+    JEQ: "pc = {a} if fl == 0b001 else {next}\n"
+         "{jump}",
+    JNE: "pc = {a} if fl == 0b100 or fl == 0b010 else {next}\n"
+         "{jump}",
+    JMP: "pc = {a}\n"
+         "{jump}",
+    ADD: "{a} = ({a} + {b}) & 0xFF",
+    PUSH: "{sp} = ({sp} - 1) & 0xFF\n"
+          "{ram}[{sp}] = {a}",
+    POP: "{a} = {ram}[{sp}]\n"
+         "{sp} = ({sp} + 1) & 0xFF",
+    CALL: "{sp} = ({sp} - 1) & 0xFF\n"
+          "{ram}[{sp}] = ({next}) & 0xFF\n"
+          "pc = {a}\n"
+          "{jump}",
+    RET: "pc = {ram}[{sp}]\n"
+         "{sp} = ({sp} + 1) & 0xFF\n"
+         "{jump}",
+    PRN: "print({a})",
+    MUL: "{a} = ({a} * {b}) & 0xFF",
+    AND: "{a} = {a} & {b}",
+    OR: "{a} = {a} | {b}",
+    XOR: "{a} = {a} ^ {b}",
+    NOT: "{a} = ~{a} & 0xFF",
+    # shift counts of 8 or more clear the register, and are clamped since
+    # machine shifts only use the low bits of the count
+    SHL: "{a} = ({a} << ({b} if {b} < 8 else 8)) & 0xFF",
+    SHR: "{a} = {a} >> ({b} if {b} < 8 else 8)",
+    MOD: "if {b} == 0:\n"
+         "    pc, status = {pc}, DIVIDE_BY_ZERO\n"
+         "    {stop}\n"
+         "{a} = {a} % {b}",
+    HLT: "pc, status = {next}, HALTED\n"
+         "{stop}",
+}
+UNKNOWN_INSTRUCTION_SOURCE = ("pc, status = {pc}, UNKNOWN_INSTRUCTION\n"
+                              "{stop}")
+BLOCK_ENDS = {JMP, JEQ, JNE, CALL, RET, HLT}
+
+# CMP as execute() spells it, without branching: only one comparison is
+# true, giving the E, L or G flag. In CPython each extra comparison, int()
+# and shift is a bytecode, so the translated programs keep the conditional
+# expression
+BRANCHLESS_CMP = ("fl = (int({a} == {b})\n"
+                  "      | (int({a} < {b}) << 2)\n"
+                  "      | (int({a} > {b}) << 1))")
+
+# Source a translated block ends with when it runs into the next one
+FALL_THROUGH_TRANSLATION = ("pc = {next}\n"
+                            "{jump}")
+
+# Most basic blocks CPU.compile_program() translates into one if/elif chain
+# over pc, rather than a function per block
+CHAINED_BLOCKS = 16
+
+# Status constants the generated code refers to
+STATUS_NAMES = {
+    "HALTED": HALTED,
+    "UNKNOWN_INSTRUCTION": UNKNOWN_INSTRUCTION,
+    "DIVIDE_BY_ZERO": DIVIDE_BY_ZERO,
+    "UNTRANSLATED_ADDRESS": UNTRANSLATED_ADDRESS,
+}
+
+
+def build_execute():
+    """
+    Generate execute(), the fetch/decode/execute loop with every
+    instruction in INSTRUCTIONS inlined into a single if/elif cascade over
+    the opcode, working only on integer state so Numba can compile it.
+
+    execute(state, pc, fl) takes RAM and registers as one block of memory,
+    `state`, with the registers stored after RAM starting at REG. It
+    returns the final pc, fl and why the loop stopped.
+    """
+    # registers are masked so a bad operand cannot reach outside them
+    spelling = {
+        "a": "state[REG + (a & 7)]",
+        "b": "state[REG + (b & 7)]",
+        "value": "b",
+        "sp": "state[SP]",
+        "ram": "state",
+        "pc": "pc",
+        "jump": "continue",
+        "stop": "return pc, fl, status",
+    }
+
+    lines = [f"{name} = {value}" for name, value in STATUS_NAMES.items()]
+    lines += [
+        "",
+        "",
+        "def execute(state, pc, fl):",
+        f"    REG = {REG}",
+        f"    SP = {REG + 7}",
+        "    while True:",
+        "        # Instruction at program counter and its operands, all kept",
+        "        # within RAM so running past the end wraps around",
+        "        pc &= 0xFF",
+        "        IR = state[pc]",
+        "        a = state[(pc + 1) & 0xFF]",
+        "        b = state[(pc + 2) & 0xFF]",
+    ]
+    instructions = {**INSTRUCTIONS, CMP: BRANCHLESS_CMP}
+
+    branch = "if"
+    for IR, source in instructions.items():
+        source = source.format(next=f"pc + {SIZE_TABLE[IR]}", **spelling)
+        if IR not in BLOCK_ENDS:
+            source += f"\npc += {SIZE_TABLE[IR]}"
+        # opcodes are written as literals, not looked up as globals
+        lines.append(f"        {branch} IR == {IR:#010b}:")
+        lines.extend("            " + line for line in source.split("\n"))
+        branch = "elif"
+    lines.append("        else:")
+    source = UNKNOWN_INSTRUCTION_SOURCE.format(**spelling)
+    lines.extend("            " + line for line in source.split("\n"))
+
+    source = "\n".join(lines) + "\n"
+
+    if njit is None:
+        namespace = {}
+        exec(compile(source, "<ls8 execute>", "exec"), namespace)
+        return namespace["execute"]
+
+    # Numba can only cache a function defined in a real file, so write the
+    # source out as a module, leaving an unchanged file alone so the
+    # cached machine code stays valid
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "__pycache__", "ls8_execute.py")
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            with open(path) as f:
+                unchanged = f.read() == source
+        except FileNotFoundError:
+            unchanged = False
+        if not unchanged:
+            # write a new file and move it into place, so another process
+            # never imports a half written module
+            temporary = f"{path}.{os.getpid()}"
+            with open(temporary, "w") as f:
+                f.write(source)
+            os.replace(temporary, path)
+    except OSError:
+        # nowhere to write the module, compile without caching
+        namespace = {}
+        exec(compile(source, "<ls8 execute>", "exec"), namespace)
+        return njit(namespace["execute"])
+
+    spec = importlib.util.spec_from_file_location("ls8_execute", path)
+    module = importlib.util.module_from_spec(spec)
+    # Numba imports the module by name when it loads the cached code
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return njit(cache=True)(module.execute)
+
+
+execute = build_execute()
+
+
+class Halt(BaseException):
+    """Raised by the HLT instruction to stop CPU.run()."""
+
 
 class CPU:
     """Main CPU class."""
 
     def __init__(self):
+        # Every value stored in ram and reg is kept to 8 bits
         self.ram = [0] * 256
         self.reg = [0] * 8
         self.pc = 0  # Program Counter
         self.sp = 7
         self.reg[self.sp] = 0xF4
         # setup branch table
-        self.branch_table = {}
+        self.branch_table = [self.handle_unknown] * 256
         self.branch_table[LDI] = self.handle_LDI
         self.branch_table[PRN] = self.handle_PRN
         self.branch_table[HLT] = self.handle_HLT
@@ -55,307 +268,525 @@ class CPU:
         self.branch_table[SHL] = self.handle_SHL
         self.branch_table[SHR] = self.handle_SHR
         self.branch_table[MOD] = self.handle_MOD
-        self.running = False
-        self.sub_pc = False
+        # setup superinstructions, one handler for a common pair of
+        # instructions
+        self.superinstructions = {}
+        self.superinstructions[(LDI, PRN)] = self.handle_LDI_PRN
+        self.superinstructions[(PUSH, PUSH)] = self.handle_PUSH_PUSH
+        self.superinstructions[(CMP, JEQ)] = self.handle_CMP_JEQ
+        self.superinstructions[(CMP, JNE)] = self.handle_CMP_JNE
+        # superinstruction handler for an address, or None to run the
+        # instruction in RAM, and where the pair covering an address starts
+        self.fused = [None] * 256
+        self.fused_start = [None] * 256
         self.fl = 0b000  # 000000LGE lower, greater, equal
+        self.program_size = 0  # number of bytes written by load()
 
     def load(self):
         """Load a program into memory."""
-        address = 0
-
         if len(sys.argv) != 2:
             print("usage: ls8.py <filename>")
             sys.exit(1)
 
         try:
-            with open(sys.argv[1]) as f:
-                for line in f:
-                    # deal with comments
-                    # split before and after any comment symbol '#'
-                    comment_split = line.split("#")
-
-                    # convert the pre-comment portion (to the left) from binary to a value
-                    # extract the first part of the split to a number variable
-                    # and trim whitespace
-                    num = comment_split[0].strip()
-
-                    # ignore blank lines / comment only lines
-                    if len(num) == 0:
-                        continue
-
-                    # set the number to an integer of base 2
-                    instruction = int(num, 2)
-                    self.ram[address] = instruction
-                    address += 1
-
+            with open(sys.argv[1], "rb") as f:
+                source = f.read()
         except FileNotFoundError:
             print(f"{sys.argv[0]}: {sys.argv[1]} not found")
             sys.exit(2)
 
-    def alu(self, op, reg_a, reg_b):
-        """ALU operations."""
-        if op == "ADD":
-            # Add the value in reg a, b and store the result in reg_a
-            self.reg[reg_a] += self.reg[reg_b]
-        elif op == "MUL":
-            # Multiply the value in reg a, b and store the result in reg_a
-            self.reg[reg_a] *= self.reg[reg_b]
-        elif op == "AND":
-            # Bitwise-OR the value in reg a, b and store the result in reg_a
-            value = self.reg[reg_a] | self.reg[reg_b]
-            self.reg[reg_a] = value
-        elif op == "OR":
-            # Bitwise-AND the value in reg a, b and store the result in reg_a
-            value = self.reg[reg_a] & self.reg[reg_b]
-            self.reg[reg_a] = value
-        elif op == "XOR":
-            # Bitwise-AND the value in reg a, b and store the result in reg_a
-            value = self.reg[reg_a] ^ self.reg[reg_b]
-            self.reg[reg_a] = value
-        elif op == "NOT":
-            # Perform a bitwise-NOT on the value in a register
-            value = ~self.reg[reg_a]
-            self.reg[reg_a] = value
-        elif op == "SHL":
-            # Shift the value in reg_a left by the number of bits specified in reg_b,
-            # filling the low bits with 0
-            value = self.reg[reg_a] << self.reg[reg_b]
-            self.reg[reg_a] = value
-        elif op == "SHR":
-            # Shift the value in reg_a right by the number of bits specified in reg_b,
-            # filling the high bits with 0
-            value = self.reg[reg_a] >> self.reg[reg_b]
-            self.reg[reg_a] = value
-        elif op == "MOD":
-            # If the value in the second register is 0,
-            if self.reg[reg_b] == 0:
-                # the system should print a message and halt
-                raise Exception(f'Can not perform operation at {self.IR:08b}')
-                self.handle_HLT(None) # unused argument
-            else:
-                # Divide the value in reg a, b and store the result in reg_a
-                value = self.reg[reg_a] % self.reg[reg_b]
-                self.reg[reg_a] = value 
-        elif op == "CMP":
-            # Compare the values in reg a, b
-            # if value at reg_a == value at reg_b
-            if self.reg[reg_a] == self.reg[reg_b]:
-                # Set E flag to 1
-                self.fl = 0b001
-            # if value at reg_a < value at reg_b
-            elif self.reg[reg_a] < self.reg[reg_b]:
-                # Set L flag to 1
-                self.fl = 0b100
-            # if value at reg_a > value at reg_b
-            elif self.reg[reg_a] > self.reg[reg_b]:
-                # set G flag to 1
-                self.fl = 0b010
-            # otherwise
-            else:
-                # set flag to 0's
-                self.fl = 0b000
-        else:
-            raise Exception("Unsupported ALU operation")
+        # take the text before any comment on every line, skipping blank
+        # lines / comment only lines, and look up the value of each one
+        lines = [num.strip() for num in PROGRAM_LINE.findall(source)]
+        try:
+            program = [BIN2BYTE[num] for num in lines if num]
+        except KeyError as error:
+            num = error.args[0]
+            print(f"{sys.argv[0]}: {sys.argv[1]} line {lines.index(num) + 1}: "
+                  f"{num.decode(errors='replace')} is not 8 binary digits")
+            sys.exit(2)
 
-    def trace(self):
+        if len(program) > len(self.ram):
+            print(f"{sys.argv[0]}: {sys.argv[1]} does not fit in memory")
+            sys.exit(2)
+
+        self.ram[:len(program)] = program
+        self.program_size = len(program)
+
+    def trace(self, pc=None):
         """
         Handy function to print out the CPU state. You might want to call this
-        from run() if you need help debugging.
+        from run() if you need help debugging, passing it the pc run() keeps
+        in a local.
         """
 
-        print(f"TRACE: %02X | %02X %02X %02X |" % (
-            self.pc,
+        ram = self.ram
+        if pc is None:
+            pc = self.pc
+        print(TRACE_FORMAT % (
+            pc,
             # self.fl,
             # self.ie,
-            self.ram_read(self.pc),
-            self.ram_read(self.pc + 1),
-            self.ram_read(self.pc + 2)
-        ), end='')
+            ram[pc],
+            ram[pc + 1],
+            ram[pc + 2],
+            *self.reg
+        ))
 
-        for i in range(8):
-            print(" %02X" % self.reg[i], end='')
+    def run(self):
+        # use the compiled run loop when Numba is available
+        if njit is not None:
+            self.run_compiled()
+        else:
+            self.run_interpreted()
 
-        print()
+    def run_interpreted(self):
+        """Run the program by dispatching each instruction to its handler."""
+        # bind attributes used on every instruction to locals once
+        self.decode()
+        fused = self.fused
+        branch_table = self.branch_table
+        ram = self.ram
+        pc = self.pc
 
-    def run(self):
-        # set to true to begin program run
-        self.running = True
-        while self.running:
-            # Instruction at program counter
-            IR = self.ram[self.pc]
-
-            # put operands a and b in dict to pass to function
-            operands = {
-                "a": self.ram_read(self.pc + 1),
-                "b": self.ram_read(self.pc + 2)
-            }
-
-            try:
-                # Instruction to execute and pass operands to function
-                self.branch_table[IR](operands)
-            except KeyError:
-                print(f"Unknown Instruction {IR:08b}")
-                sys.exit(1)
-
-            # Get the instruction size from IR
-            # Right Shift by 6 and mask
-            instruction_size = ((IR >> 6) & 0b11) + 1
-
-            # If a sub-routine was not run
-            if not self.sub_pc:
-                # update the instruction size
-                self.pc += instruction_size
-
-    # Read a value in memory at a particular address
-    def ram_read(self, MAR):
-        # return the memory[Memory Address Register]
-        return self.ram[MAR]
-
-    # Write a value to the register at a particular address
-    def raw_write(self, MAR, MDR):
-        # Register[Memory Address Register] = Memory Data Register
-        self.reg[MAR] = MDR
-
-    def handle_LDI(self, operands):
-        # Invoke the raw_write method to write to register at given address
-        self.raw_write(operands["a"], operands["b"])
-        # Not a sub-routine operation, set sub_pc to False
-        self.sub_pc = False
-
-    def handle_PRN(self, operands):
-        # Print the value in the register at a given address
-        print(self.reg[operands["a"]])
-        # Not a sub-routine operation, set sub_pc to False
-        self.sub_pc = False
+        try:
+            while True:
+                # Run the superinstruction at program counter, or else the
+                # handler for the instruction in RAM. Each handler reads its
+                # own operands and returns the address of the next
+                # instruction to run
+                pc = (fused[pc] or branch_table[ram[pc]])(pc)
+        except Halt:
+            # move past the HLT like any other instruction
+            pc += 1
+        finally:
+            # keep self.pc current however the program stops
+            self.pc = pc
+
+    def decode(self):
+        """
+        Find the pairs of instructions in the loaded program listed in
+        superinstructions and give each one handler doing the work of
+        both, so they are dispatched once. Writing to RAM covered by a
+        pair drops its handler again (see forget_fused()).
+        """
+        ram = self.ram
+        fused = self.fused
+        fused_start = self.fused_start
+        fused[:] = [None] * len(ram)
+        fused_start[:] = [None] * len(ram)
 
-    def handle_MUL(self, operands):
-        # Invoke the ALU to perform MUL operation passing operands a and b
-        self.alu("MUL", operands["a"], operands["b"])
-        # Not a sub-routine operation, set sub_pc to False
-        self.sub_pc = False
+        address = 0
+        while address < self.program_size:
+            next_address = address + SIZE_TABLE[ram[address]]
+            if next_address < self.program_size:
+                pair = (ram[address], ram[next_address])
+                if pair in self.superinstructions:
+                    # a jump to the second instruction still runs it alone
+                    fused[address] = self.superinstructions[pair]
+                    end = min(next_address + SIZE_TABLE[pair[1]], len(ram))
+                    for covered in range(address, end):
+                        fused_start[covered] = address
+            address = next_address
+
+    def forget_fused(self, address):
+        # Code at address was overwritten, run it from RAM from now on
+        start = self.fused_start[address]
+        if start is not None:
+            self.fused[start] = None
+
+    def run_compiled(self):
+        """
+        Run the program with the single-function execute() loop, compiled
+        by Numba when it is installed, then copy the final state back.
+        """
+        # one contiguous block with the registers following RAM
+        state = self.ram + self.reg
+        if np is not None:
+            state = np.array(state, dtype=np.uint8)
+
+        pc, fl, status = execute(state, self.pc, self.fl)
+
+        state = [int(value) for value in state]
+        self.ram[:] = state[:REG]
+        self.reg[:] = state[REG:]
+        self.pc = int(pc)
+        self.fl = int(fl)
+        self.report_status(status)
+
+    def compile_program(self):
+        """
+        Translate the loaded program into Python source and compile it.
+        Jump targets are found from the addresses loaded with LDI. Assumes
+        the program does not modify its own code.
+
+        A program with up to CHAINED_BLOCKS basic blocks becomes one
+        `if pc == ...` chain in a loop. Past that, walking the chain on
+        every jump costs more than a call, so each block becomes a function
+        that ends by picking the block to run next.
+
+        Returns a function taking (ram, reg, fl) that returns the final
+        pc, fl and why it stopped, like execute().
+        """
+        ram = self.ram
+
+        # Walk the instructions, collecting the addresses a block can start
+        # at: the entry point, whatever follows a branch, and any address
+        # loaded into a register (the only way to reach a jump target)
+        addresses = []
+        leaders = {self.pc}
+        address = 0
+        while address < self.program_size:
+            IR = ram[address]
+            addresses.append(address)
+            next_address = address + SIZE_TABLE[IR]
+            if IR == LDI:
+                leaders.add(ram[(address + 2) & 0xFF])
+            if IR in BLOCK_ENDS or IR not in INSTRUCTIONS:
+                leaders.add(next_address)
+            address = next_address
+
+        chained = len(leaders.intersection(addresses)) <= CHAINED_BLOCKS
+        lines = [
+            "def program(ram, reg, fl):",
+            f"    pc = {self.pc}",
+            "    status = UNTRANSLATED_ADDRESS",
+        ]
+        if chained:
+            lines.append("    while True:")
+        else:
+            # room for the address following an instruction at the end of RAM
+            lines.append(f"    blocks = [None] * {len(ram) + 3}")
+        branch = "if"
+        block_addresses = []
+        in_block = False
+        for address in addresses:
+            IR = ram[address]
+            next_address = address + SIZE_TABLE[IR]
+
+            if address in leaders:
+                if in_block:
+                    # fall through into the next block
+                    lines.extend(self.translate(FALL_THROUGH_TRANSLATION, address, address, chained))
+                if chained:
+                    lines.append(f"        {branch} pc == {address}:")
+                    branch = "elif"
+                else:
+                    lines.append(f"    def block_{address}():")
+                    lines.append("        nonlocal pc, fl, status")
+                block_addresses.append(address)
+                in_block = True
+            elif not in_block:
+                # unreachable code after a branch
+                continue
+
+            source = INSTRUCTIONS.get(IR, UNKNOWN_INSTRUCTION_SOURCE)
+            lines.extend(self.translate(source, address, next_address, chained))
+
+            if IR in BLOCK_ENDS or IR not in INSTRUCTIONS:
+                in_block = False
+
+        if in_block:
+            lines.extend(self.translate(FALL_THROUGH_TRANSLATION, address, next_address, chained))
+
+        if chained:
+            # stop at an address that was not translated
+            if branch == "elif":
+                lines.append("        else:")
+                lines.append("            return pc, fl, status")
+            else:
+                lines.append("        return pc, fl, status")
+        else:
+            lines.extend(
+                f"    blocks[{address}] = block_{address}"
+                for address in block_addresses
+            )
+            # Every block returns the next one to run, until one stops or
+            # execution reaches an address that was not translated
+            lines.extend([
+                "    block = blocks[pc]",
+                "    while block is not None:",
+                "        block = block()",
+                "    return pc, fl, status",
+            ])
+
+        namespace = dict(STATUS_NAMES)
+        exec(compile("\n".join(lines), "<ls8>", "exec"), namespace)
+        return namespace["program"]
+
+    def translate(self, source, address, next_address, chained):
+        # Fill in an instruction's source, with its operands and addresses
+        # as constants, and indent it into its branch of the chain or its
+        # block function
+        a = self.ram[(address + 1) & 0xFF]
+        b = self.ram[(address + 2) & 0xFF]
+        source = source.format(
+            a=f"reg[{a & 7}]",
+            b=f"reg[{b & 7}]",
+            value=b,
+            sp="reg[7]",
+            ram="ram",
+            pc=address,
+            next=next_address,
+            jump="continue" if chained else "return blocks[pc]",
+            stop="return pc, fl, status" if chained else "return None",
+        )
+        indent = " " * 12 if chained else " " * 8
+        return [indent + line for line in source.split("\n")]
+
+    def run_translated(self):
+        """
+        Run the program translated by compile_program(), falling back to
+        run() if it jumps somewhere that was not translated.
+        """
+        program = self.compile_program()
+        self.pc, self.fl, status = program(self.ram, self.reg, self.fl)
+
+        if status == UNTRANSLATED_ADDRESS:
+            self.run()
+            return
+        self.report_status(status)
+
+    def report_status(self, status):
+        # Print a message and exit if the program stopped on an error
+        if status == UNKNOWN_INSTRUCTION:
+            print(f"Unknown Instruction {self.ram[self.pc]:08b}")
+            sys.exit(1)
+        if status == DIVIDE_BY_ZERO:
+            print(f"Can not perform MOD by zero at {self.pc:02X}")
+            sys.exit(1)
+
+    def handle_LDI(self, pc):
+        ram = self.ram
+        # Write the value to the register at given address
+        self.reg[ram[pc + 1] & 7] = ram[pc + 2]
+        return pc + 3
 
-    def handle_PUSH(self, operands):
+    def handle_PRN(self, pc):
+        # Print the value in the register at a given address
+        print(self.reg[self.ram[pc + 1] & 7])
+        return pc + 2
+
+    def handle_MUL(self, pc):
+        ram = self.ram
+        reg = self.reg
+        a = ram[pc + 1] & 7
+        # Multiply the value in reg a, b and store the result in reg a
+        reg[a] = (reg[a] * reg[ram[pc + 2] & 7]) & 0xFF
+        return pc + 3
+
+    def handle_PUSH(self, pc):
+        ram = self.ram
+        reg = self.reg
         # decrement self.sp
-        self.reg[self.sp] -= 1
+        reg[self.sp] = (reg[self.sp] - 1) & 0xFF
         # value at given register
-        value = self.reg[operands["a"]]
+        value = reg[ram[pc + 1] & 7]
         # address the stack pointer is pointing to
-        address = self.reg[self.sp]
+        address = reg[self.sp]
         # Push the value in the given register on the stack
-        self.ram[address] = value
-        # Not a sub-routine operation, set sub_pc to False
-        self.sub_pc = False
+        ram[address] = value
+        if self.fused_start[address] is not None:
+            self.forget_fused(address)
+        return pc + 2
 
-    def handle_POP(self, operands):
+    def handle_POP(self, pc):
         # Pop the value at the top of the stack into the given register
-        self.reg[operands["a"]] = self.ram_read(self.reg[self.sp])
-        self.reg[self.sp] += 1
-        # Not a sub-routine operation, set sub_pc to False
-        self.sub_pc = False
+        ram = self.ram
+        reg = self.reg
+        reg[ram[pc + 1] & 7] = ram[reg[self.sp]]
+        reg[self.sp] = (reg[self.sp] + 1) & 0xFF
+        return pc + 2
 
     # Calls a subroutine (function) at the address stored in the register
-    def handle_CALL(self, operands):
-        self.reg[self.sp] -= 1  # Decrement Stack Pointer
+    def handle_CALL(self, pc):
+        ram = self.ram
+        reg = self.reg
+        reg[self.sp] = (reg[self.sp] - 1) & 0xFF  # Decrement Stack Pointer
         # Push return location to stack
-        self.ram[self.reg[self.sp]] = self.pc + 2
+        address = reg[self.sp]
+        ram[address] = (pc + 2) & 0xFF
+        if self.fused_start[address] is not None:
+            self.forget_fused(address)
         # set pc to subroutine
-        self.pc = self.reg[operands["a"]]
-        # sub-routine operation, set sub_pc to True
-        self.sub_pc = True
+        return reg[ram[pc + 1] & 7]
 
-    def handle_RET(self, operands):
+    def handle_RET(self, pc):
         # Return from subroutine
         # Pop the value from the top of the stack and store it in the `PC`
-        self.pc = self.ram_read(self.reg[self.sp])
-        self.reg[self.sp] += 1
-        # sub-routine operation, set sub_pc to True
-        self.sub_pc = True
-
-    def handle_ADD(self, operands):
-        # Invoke the ALU to perform ADD operation passing operands a and b
-        self.alu("ADD", operands["a"], operands["b"])
-        # Not a sub-routine operation, set sub_pc to False
-        self.sub_pc = False
-
-    def handle_CMP(self, operands):
-        # Invoke the ALU to perform CMP operation passing operands a and b
-        self.alu("CMP", operands["a"], operands["b"])
-        # Not a sub-routine operation, set sub_pc to False
-        self.sub_pc = False
-
-    def handle_JMP(self, operands):
+        reg = self.reg
+        return_address = self.ram[reg[self.sp]]
+        reg[self.sp] = (reg[self.sp] + 1) & 0xFF
+        return return_address
+
+    def handle_ADD(self, pc):
+        ram = self.ram
+        reg = self.reg
+        a = ram[pc + 1] & 7
+        # Add the value in reg a, b and store the result in reg a
+        reg[a] = (reg[a] + reg[ram[pc + 2] & 7]) & 0xFF
+        return pc + 3
+
+    def handle_CMP(self, pc):
+        ram = self.ram
+        # Compare the values in reg a, b
+        value_a = self.reg[ram[pc + 1] & 7]
+        value_b = self.reg[ram[pc + 2] & 7]
+        # if value at reg a == value at reg b
+        if value_a == value_b:
+            # Set E flag to 1
+            self.fl = 0b001
+        # if value at reg a < value at reg b
+        elif value_a < value_b:
+            # Set L flag to 1
+            self.fl = 0b100
+        # value at reg a > value at reg b
+        else:
+            # set G flag to 1
+            self.fl = 0b010
+        return pc + 3
+
+    def handle_JMP(self, pc):
         # Jump to the address stored in the given register
         # Set the `PC` to the address stored in the given register.
-        self.pc = self.reg[operands["a"]]
-        # sub-routine operation, set sub_pc to True
-        self.sub_pc = True
+        return self.reg[self.ram[pc + 1] & 7]
 
-    def handle_JNE(self, operands):
+    def handle_JNE(self, pc):
         # If E flag == 0
         if self.fl == 0b100 or self.fl == 0b010:
             # jump to the address stored in the given register
-            self.pc = self.reg[operands["a"]]
-            # sub-routine operation, set sub_pc to True
-            self.sub_pc = True
-        # Otherwise
-        else:
-            # No sub-routine operation was performed, set sub_pc to False
-            self.sub_pc = False
+            return self.reg[self.ram[pc + 1] & 7]
+        return pc + 2
 
-    def handle_JEQ(self, operands):
+    def handle_JEQ(self, pc):
         # If E flag == 1
         if self.fl == 0b001:
             # jump to the address stored in the given register
-            self.pc = self.reg[operands["a"]]
-            # sub-routine operation, set sub_pc to True
-            self.sub_pc = True
-        # Otherwise
-        else:
-            # No sub-routine operation was performed, set sub_pc to False
-            self.sub_pc = False
-
-    def handle_AND(self, operands):
-        # Invoke the ALU to perform AND operation passing operands a and b
-        self.alu("AND", operands["a"], operands["b"])
-        # Not a sub-routine operation, set sub_pc to False
-        self.sub_pc = False
-
-    def handle_OR(self, operands):
-        # Invoke the ALU to perform OR operation passing operands a and b
-        self.alu("OR", operands["a"], operands["b"])
-        # Not a sub-routine operation, set sub_pc to False
-        self.sub_pc = False
-
-    def handle_XOR(self, operands):
-        # Invoke the ALU to perform XOR operation passing operands a and b
-        self.alu("XOR", operands["a"], operands["b"])
-        # Not a sub-routine operation, set sub_pc to False
-        self.sub_pc = False
-
-    def handle_NOT(self, operands):
-        # Invoke the ALU to perform NOT operation passing operands a and b
-        self.alu("NOT", operands["a"], operands["b"])
-        # Not a sub-routine operation, set sub_pc to False
-        self.sub_pc = False
-
-    def handle_SHL(self, operands):
-        # Invoke the ALU to perform SHL operation passing operands a and b
-        self.alu("SHL", operands["a"], operands["b"])
-        # Not a sub-routine operation, set sub_pc to False
-        self.sub_pc = False
-
-    def handle_SHR(self, operands):
-        # Invoke the ALU to perform SHR operation passing operands a and b
-        self.alu("SHR", operands["a"], operands["b"])
-        # Not a sub-routine operation, set sub_pc to False
-        self.sub_pc = False
-
-    def handle_MOD(self, operands):
-        # Invoke the ALU to perform MOD operation passing operands a and b
-        self.alu("MOD", operands["a"], operands["b"])
-        # Not a sub-routine operation, set sub_pc to False
-        self.sub_pc = False
-
-    def handle_HLT(self, operands):
-        # set running to False to Halt/End program run
-        self.running = False
+            return self.reg[self.ram[pc + 1] & 7]
+        return pc + 2
+
+    def handle_AND(self, pc):
+        ram = self.ram
+        reg = self.reg
+        a = ram[pc + 1] & 7
+        # Bitwise-AND the value in reg a, b and store the result in reg a
+        reg[a] = reg[a] & reg[ram[pc + 2] & 7]
+        return pc + 3
+
+    def handle_OR(self, pc):
+        ram = self.ram
+        reg = self.reg
+        a = ram[pc + 1] & 7
+        # Bitwise-OR the value in reg a, b and store the result in reg a
+        reg[a] = reg[a] | reg[ram[pc + 2] & 7]
+        return pc + 3
+
+    def handle_XOR(self, pc):
+        ram = self.ram
+        reg = self.reg
+        a = ram[pc + 1] & 7
+        # Bitwise-XOR the value in reg a, b and store the result in reg a
+        reg[a] = reg[a] ^ reg[ram[pc + 2] & 7]
+        return pc + 3
+
+    def handle_NOT(self, pc):
+        reg = self.reg
+        a = self.ram[pc + 1] & 7
+        # Perform a bitwise-NOT on the value in a register
+        reg[a] = ~reg[a] & 0xFF
+        return pc + 2
+
+    def handle_SHL(self, pc):
+        ram = self.ram
+        reg = self.reg
+        a = ram[pc + 1] & 7
+        # Shift the value in reg a left by the number of bits specified in reg b,
+        # filling the low bits with 0
+        reg[a] = (reg[a] << reg[ram[pc + 2] & 7]) & 0xFF
+        return pc + 3
+
+    def handle_SHR(self, pc):
+        ram = self.ram
+        reg = self.reg
+        a = ram[pc + 1] & 7
+        # Shift the value in reg a right by the number of bits specified in reg b,
+        # filling the high bits with 0
+        reg[a] = reg[a] >> reg[ram[pc + 2] & 7]
+        return pc + 3
+
+    def handle_MOD(self, pc):
+        ram = self.ram
+        reg = self.reg
+        a = ram[pc + 1] & 7
+        b = ram[pc + 2] & 7
+        # If the value in the second register is 0,
+        if reg[b] == 0:
+            # the system should print a message and halt
+            print(f"Can not perform MOD by zero at {pc:02X}")
+            sys.exit(1)
+        # Divide the value in reg a, b and store the remainder in reg a
+        reg[a] = reg[a] % reg[b]
+        return pc + 3
+
+    def handle_LDI_PRN(self, pc):
+        ram = self.ram
+        reg = self.reg
+        # LDI followed by PRN
+        reg[ram[pc + 1] & 7] = ram[pc + 2]
+        print(reg[ram[pc + 4] & 7])
+        return pc + 5
+
+    def handle_PUSH_PUSH(self, pc):
+        ram = self.ram
+        reg = self.reg
+        fused_start = self.fused_start
+        # PUSH followed by PUSH, each push moves the stack pointer before
+        # reading its register, in case it is the stack pointer itself
+        sp = self.sp
+        reg[sp] = (reg[sp] - 1) & 0xFF
+        address = reg[sp]
+        ram[address] = reg[ram[pc + 1] & 7]
+        if fused_start[address] is not None:
+            self.forget_fused(address)
+            if address == pc + 2 or address == pc + 3:
+                # the first push overwrote the second, run it from RAM
+                return pc + 2
+        reg[sp] = (reg[sp] - 1) & 0xFF
+        address = reg[sp]
+        ram[address] = reg[ram[pc + 3] & 7]
+        if fused_start[address] is not None:
+            self.forget_fused(address)
+        return pc + 4
+
+    def handle_CMP_JEQ(self, pc):
+        ram = self.ram
+        reg = self.reg
+        # CMP followed by JEQ
+        value_a = reg[ram[pc + 1] & 7]
+        value_b = reg[ram[pc + 2] & 7]
+        if value_a == value_b:
+            self.fl = 0b001
+            return reg[ram[pc + 4] & 7]
+        self.fl = 0b100 if value_a < value_b else 0b010
+        return pc + 5
+
+    def handle_CMP_JNE(self, pc):
+        ram = self.ram
+        reg = self.reg
+        # CMP followed by JNE
+        value_a = reg[ram[pc + 1] & 7]
+        value_b = reg[ram[pc + 2] & 7]
+        if value_a == value_b:
+            self.fl = 0b001
+            return pc + 5
+        self.fl = 0b100 if value_a < value_b else 0b010
+        return reg[ram[pc + 4] & 7]
+
+    def handle_unknown(self, pc):
+        # Every opcode without an instruction ends the program
+        print(f"Unknown Instruction {self.ram[pc]:08b}")
+        sys.exit(1)
+
+    def handle_HLT(self, pc):
+        # Halt/End program run
+        raise Halt
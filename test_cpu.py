@@ -0,0 +1,296 @@
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from cpu import *
+
+
+def run_program(program, method, fuse=True):
+    """
+    Run a program with one of the CPU's run methods and return what it
+    printed and the final machine state.
+    """
+    cpu = CPU()
+    cpu.ram[:len(program)] = program
+    cpu.program_size = len(program)
+    if not fuse:
+        cpu.superinstructions = {}
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        try:
+            getattr(cpu, method)()
+        except SystemExit:
+            pass
+
+    return output.getvalue(), cpu.pc, cpu.fl, list(cpu.reg), list(cpu.ram)
+
+
+PROGRAMS = {
+    "push_sp": [
+        LDI, 0, 5,
+        PUSH, 7,
+        PUSH, 0,
+        POP, 1,
+        POP, 2,
+        PRN, 1,
+        PRN, 2,
+        HLT,
+    ],
+    "push_pop": [
+        LDI, 0, 7,
+        LDI, 1, 9,
+        PUSH, 0,
+        PUSH, 1,
+        POP, 2,
+        POP, 3,
+        PRN, 2,
+        PRN, 3,
+        HLT,
+    ],
+    "compare_jump": [
+        LDI, 0, 1,
+        LDI, 1, 2,
+        LDI, 2, 19,
+        CMP, 0, 1,
+        JNE, 2,
+        LDI, 3, 1,
+        PRN, 3,
+        LDI, 4, 29,
+        CMP, 0, 0,
+        JEQ, 4,
+        PRN, 0,
+        HLT,
+    ],
+    "call_loop": [
+        LDI, 0, 0,
+        LDI, 1, 20,
+        LDI, 2, 1,
+        LDI, 3, 15,
+        LDI, 4, 28,
+        CALL, 4,
+        ADD, 0, 2,
+        CMP, 0, 1,
+        JNE, 3,
+        PRN, 0,
+        HLT,
+        PUSH, 0,
+        POP, 5,
+        RET,
+    ],
+    "alu": [
+        LDI, 0, 0b1100,
+        LDI, 1, 0b1010,
+        LDI, 2, 2,
+        AND, 0, 1,
+        OR, 0, 1,
+        XOR, 0, 2,
+        NOT, 1,
+        SHL, 0, 2,
+        SHR, 1, 2,
+        MUL, 0, 1,
+        ADD, 0, 1,
+        MOD, 0, 2,
+        PRN, 0,
+        PRN, 1,
+        HLT,
+    ],
+    "large_shift": [
+        LDI, 0, 1,
+        LDI, 1, 200,
+        LDI, 2, 70,
+        SHL, 0, 2,
+        SHR, 1, 2,
+        PRN, 0,
+        PRN, 1,
+        HLT,
+    ],
+    "mod_by_zero": [
+        LDI, 0, 5,
+        MOD, 0, 1,
+        PRN, 0,
+        HLT,
+    ],
+}
+
+
+# Programs that PUSH an HLT over their own code, at an instruction that
+# is not part of a superinstruction, at one that is, and at the second
+# instruction of the superinstruction doing the PUSH
+SELF_MODIFYING_PROGRAMS = {
+    "overwrite_code": [
+        LDI, 7, 9,
+        LDI, 0, HLT,
+        PUSH, 0,
+        PRN, 0,
+        HLT,
+    ],
+    "overwrite_fused": [
+        LDI, 7, 9,
+        LDI, 0, HLT,
+        PUSH, 0,
+        LDI, 1, 3,
+        PRN, 1,
+        HLT,
+    ],
+    "overwrite_own_pair": [
+        LDI, 7, 12,
+        LDI, 0, HLT,
+        LDI, 1, 5,
+        PUSH, 0,
+        PUSH, 1,
+        PRN, 1,
+        HLT,
+    ],
+}
+
+
+class RunMethodsTest(unittest.TestCase):
+    """Every way of running a program gives the same result."""
+
+    def test_fused_matches_unfused(self):
+        for name, program in PROGRAMS.items():
+            with self.subTest(program=name):
+                self.assertEqual(
+                    run_program(program, "run_interpreted"),
+                    run_program(program, "run_interpreted", fuse=False),
+                )
+
+    def test_compiled_matches_interpreted(self):
+        for name, program in PROGRAMS.items():
+            with self.subTest(program=name):
+                self.assertEqual(
+                    run_program(program, "run_compiled"),
+                    run_program(program, "run_interpreted", fuse=False),
+                )
+
+    def test_translated_matches_interpreted(self):
+        # translate to an if/elif chain and to a function per block, and
+        # never fall back to run()
+        for chained_blocks in (CHAINED_BLOCKS, 0):
+            for name, program in PROGRAMS.items():
+                with self.subTest(program=name, chained_blocks=chained_blocks), \
+                        mock.patch("cpu.CHAINED_BLOCKS", chained_blocks), \
+                        mock.patch.object(CPU, "run", side_effect=AssertionError):
+                    self.assertEqual(
+                        run_program(program, "run_translated"),
+                        run_program(program, "run_interpreted", fuse=False),
+                    )
+
+    def test_overwritten_code_runs_from_ram(self):
+        for name, program in SELF_MODIFYING_PROGRAMS.items():
+            with self.subTest(program=name):
+                output, *_ = run_program(program, "run_interpreted")
+                self.assertEqual(output, "")
+                self.assertEqual(
+                    run_program(program, "run_interpreted"),
+                    run_program(program, "run_interpreted", fuse=False),
+                )
+                self.assertEqual(
+                    run_program(program, "run_compiled"),
+                    run_program(program, "run_interpreted", fuse=False),
+                )
+
+    def test_register_operands_are_masked(self):
+        # only the low 3 bits of a register operand name the register
+        for method in ("run_interpreted", "run_compiled", "run_translated"):
+            with self.subTest(method=method):
+                output, *_ = run_program([LDI, 0x82, 5, PRN, 2, HLT], method)
+                self.assertEqual(output, "5\n")
+
+    def test_call_return_address_wraps(self):
+        # CALL in the last two bytes of RAM returns to address 0
+        for method in ("run_interpreted", "run_compiled"):
+            with self.subTest(method=method):
+                cpu = CPU()
+                cpu.ram[:5] = [POP, 2, PRN, 2, HLT]
+                cpu.ram[254:256] = [CALL, 1]
+                cpu.pc = 254
+                output = io.StringIO()
+                with contextlib.redirect_stdout(output):
+                    getattr(cpu, method)()
+                self.assertEqual(output.getvalue(), "0\n")
+
+
+class CompiledLoopTest(unittest.TestCase):
+    """execute() never reaches outside RAM and the registers."""
+
+    def test_pc_wraps_around_ram(self):
+        cpu = CPU()
+        cpu.ram[0] = HLT
+        cpu.ram[253:256] = [LDI, 1, 9]
+        cpu.pc = 253
+        cpu.run_compiled()
+        self.assertEqual((cpu.pc, cpu.reg[1]), (1, 9))
+
+
+def load_program(path):
+    """Load a program file the way ls8.py does and return the CPU."""
+    argv = sys.argv
+    sys.argv = ["ls8.py", path]
+    try:
+        cpu = CPU()
+        cpu.load()
+    finally:
+        sys.argv = argv
+    return cpu
+
+
+class LoadTest(unittest.TestCase):
+
+    def test_sctest(self):
+        cpu = load_program("sctest.ls8")
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            cpu.run()
+        self.assertEqual(output.getvalue(), "1\n4\n5\n")
+
+    def test_comments_and_blank_lines(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "program.ls8")
+            with open(path, "w") as f:
+                f.write("# comment\n\n  10000010 # LDI\r\n00000001\n00001010#\n")
+            cpu = load_program(path)
+        self.assertEqual((cpu.ram[:3], cpu.program_size), ([LDI, 1, 10], 3))
+
+    def test_bad_lines_are_reported(self):
+        for line in ("100000101", "1010", "10000010 1", "1000001x"):
+            with self.subTest(line=line), tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, "program.ls8")
+                with open(path, "w") as f:
+                    f.write(f"00000001\n{line} # bad\n00000001\n")
+                output = io.StringIO()
+                with contextlib.redirect_stdout(output), \
+                        self.assertRaises(SystemExit) as exit:
+                    load_program(path)
+                self.assertEqual(exit.exception.code, 2)
+                self.assertIn(f"line 2: {line} is not 8 binary digits",
+                              output.getvalue())
+
+
+class CommandLineTest(unittest.TestCase):
+    """ls8.py runs the same each time, including from a compile cache."""
+
+    def test_runs_twice(self):
+        for run in range(2):
+            with self.subTest(run=run):
+                result = subprocess.run(
+                    [sys.executable, "ls8.py", "sctest.ls8"],
+                    cwd=os.path.dirname(os.path.abspath(__file__)),
+                    capture_output=True,
+                    text=True,
+                )
+                self.assertEqual(
+                    (result.returncode, result.stdout, result.stderr),
+                    (0, "1\n4\n5\n", ""),
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()